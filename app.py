@@ -1,203 +1,729 @@
 # app.py
 import streamlit as st
+import extra_streamlit_components as stx
 import google.oauth2.credentials
-import google_auth_oauthlib.flow
-import googleapiclient.discovery
+import google.auth.transport.requests
+import googleapiclient.errors
+import google.auth.exceptions
+import httpx
 import os
-from urllib.parse import urlencode
+import pandas as pd
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import hmac
+import io
 import json
-import pickle
+import re
+import secrets
+import tempfile
 from pathlib import Path
 
 # Streamlit config
 st.set_page_config(page_title="YouTube Playlists", page_icon="▶️")
 
 # Constants
-SCOPES = ['https://www.googleapis.com/auth/youtube.readonly']
+SCOPES = ['https://www.googleapis.com/auth/youtube']
 API_SERVICE_NAME = 'youtube'
 API_VERSION = 'v3'
-CREDENTIALS_FILE = '.credentials/youtube_credentials.pickle'
+CREDENTIALS_FILE = '.credentials/youtube_credentials.json'
+AUDIT_DB = 'youtube_audit.db'
+REFRESH_TOKEN_COOKIE = 'yt_rt'
+REFRESH_WINDOW_SECONDS = 300
+
+# Single worker is enough: at most one token refresh is in flight
+_REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=1)
 
 def ensure_credentials_dir():
     """Ensure the credentials directory exists"""
     Path('.credentials').mkdir(exist_ok=True)
 
 def save_credentials(credentials):
-    """Save credentials to file"""
+    """Save credentials to file with an atomic replace"""
     ensure_credentials_dir()
-    with open(CREDENTIALS_FILE, 'wb') as f:
-        pickle.dump(credentials_to_dict(credentials), f)
+    with tempfile.NamedTemporaryFile('w', dir='.credentials', delete=False) as f:
+        json.dump(credentials_to_dict(credentials), f)
+    os.replace(f.name, CREDENTIALS_FILE)
 
 def load_credentials():
     """Load credentials from file"""
     try:
-        with open(CREDENTIALS_FILE, 'rb') as f:
-            credentials_dict = pickle.load(f)
-            return google.oauth2.credentials.Credentials(**credentials_dict)
-    except (FileNotFoundError, EOFError):
+        with open(CREDENTIALS_FILE) as f:
+            return credentials_from_dict(json.load(f))
+    except (FileNotFoundError, ValueError):
         return None
 
 def credentials_to_dict(credentials):
-    """Convert credentials to dictionary"""
+    """Convert credentials to a flat dict of plain strings"""
     return {
         'token': credentials.token,
         'refresh_token': credentials.refresh_token,
         'token_uri': credentials.token_uri,
         'client_id': credentials.client_id,
         'client_secret': credentials.client_secret,
-        'scopes': credentials.scopes
+        'scopes': credentials.scopes,
+        'expiry': credentials.expiry.isoformat() if credentials.expiry else None
     }
 
-def get_authorization_url():
-    """Get the authorization URL for OAuth2"""
-    flow = google_auth_oauthlib.flow.Flow.from_client_config(
-        {
-            "web": {
-                "client_id": st.secrets["client_id"],
-                "client_secret": st.secrets["client_secret"],
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [st.secrets["redirect_uri"]]
-            }
-        },
+def credentials_from_dict(creds_dict):
+    """Rebuild a Credentials object from the flat dict"""
+    creds_dict = dict(creds_dict)
+    expiry = creds_dict.pop('expiry', None)
+    credentials = google.oauth2.credentials.Credentials(**creds_dict)
+    if expiry:
+        credentials.expiry = datetime.fromisoformat(expiry)
+    return credentials
+
+def build_flow():
+    """Build the OAuth2 flow from the client config"""
+    flow_module, _ = _google_modules()
+    config = _client_config()
+    flow = flow_module.Flow.from_client_config(
+        config,
         scopes=SCOPES
     )
-    
-    flow.redirect_uri = st.secrets["redirect_uri"]
-    
+
+    flow.redirect_uri = config["web"]["redirect_uris"][0]
+
+    return flow
+
+@st.cache_resource(show_spinner=False)
+def _google_modules():
+    """Import the heavy Google client modules once per process
+
+    google_auth_oauthlib.flow and googleapiclient.discovery pull in
+    oauthlib and httplib2 on import, which costs a few hundred ms on a
+    cold start the unauthenticated landing render does not need.
+    """
+    import google_auth_oauthlib.flow
+    import googleapiclient.discovery
+    return google_auth_oauthlib.flow, googleapiclient.discovery
+
+@st.cache_resource(show_spinner=False)
+def _client_config():
+    """Assemble the OAuth client config from secrets once per process"""
+    return {
+        "web": {
+            "client_id": st.secrets["client_id"],
+            "client_secret": st.secrets["client_secret"],
+            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+            "token_uri": "https://oauth2.googleapis.com/token",
+            "redirect_uris": [st.secrets["redirect_uri"]]
+        }
+    }
+
+@st.cache_resource(show_spinner=False)
+def _token_client():
+    """Shared HTTP client for token-endpoint calls; HTTP/2 keep-alive
+    amortizes the TLS handshake across exchanges and refreshes"""
+    return httpx.Client(http2=True, timeout=10.0)
+
+def exchange_code(code):
+    """Exchange an authorization code for credentials at the token endpoint"""
+    config = _client_config()["web"]
+    response = _token_client().post(
+        config["token_uri"],
+        data={
+            'code': code,
+            'client_id': config["client_id"],
+            'client_secret': config["client_secret"],
+            'redirect_uri': config["redirect_uris"][0],
+            'grant_type': 'authorization_code'
+        }
+    )
+    response.raise_for_status()
+    payload = response.json()
+
+    return google.oauth2.credentials.Credentials(
+        token=payload['access_token'],
+        refresh_token=payload.get('refresh_token'),
+        token_uri=config["token_uri"],
+        client_id=config["client_id"],
+        client_secret=config["client_secret"],
+        scopes=SCOPES,
+        expiry=datetime.utcnow() + timedelta(seconds=payload.get('expires_in', 3600))
+    )
+
+def delete_refresh_cookie(cookie_manager):
+    """Remove the refresh token cookie if the browser sent one
+
+    CookieManager.delete raises KeyError when the cookie is absent,
+    e.g. a session authenticated from the server-side credentials file
+    or one whose cookie expired while the file stayed valid.
+    """
+    if cookie_manager.get(REFRESH_TOKEN_COOKIE) is not None:
+        cookie_manager.delete(REFRESH_TOKEN_COOKIE)
+
+def credentials_from_refresh_token(refresh_token):
+    """Rebuild credentials from a refresh token stored in the browser cookie"""
+    config = _client_config()["web"]
+    return google.oauth2.credentials.Credentials(
+        token=None,
+        refresh_token=refresh_token,
+        token_uri=config["token_uri"],
+        client_id=config["client_id"],
+        client_secret=config["client_secret"],
+        scopes=SCOPES
+    )
+
+def get_authorization_url():
+    """Get the authorization URL for OAuth2"""
+    flow = build_flow()
+
     authorization_url, state = flow.authorization_url(
         access_type='offline',
         include_granted_scopes='true',
-        prompt='consent'
+        prompt='consent',
+        state=secrets.token_urlsafe(16)
     )
-    
+
     return authorization_url, state
 
-def get_playlists(youtube):
-    """Get all playlists for the authenticated user"""
-    request = youtube.playlists().list(
-        part="snippet",
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_playlists_raw(_youtube, token):
+    """Fetch every playlist for the authenticated user
+
+    Cached per access token so reruns within the TTL reuse the last
+    response instead of hitting the API. The client itself is passed
+    with a leading underscore so Streamlit skips hashing it.
+    """
+    request = _youtube.playlists().list(
+        part="snippet,contentDetails",
         mine=True,
-        maxResults=50
+        maxResults=50,
+        fields="items(id,snippet/title,contentDetails/itemCount),nextPageToken"
     )
-    response = request.execute()
-    
+
     playlists = []
-    for item in response.get('items', []):
-        playlist = {
-            'id': item['id'],
-            'title': item['snippet']['title']
-        }
-        playlists.append(playlist)
-    
+    while request is not None:
+        response = request.execute()
+        playlists.extend(
+            {
+                'id': item['id'],
+                'title': item['snippet']['title'],
+                'item_count': item['contentDetails']['itemCount']
+            }
+            for item in response.get('items', ())
+        )
+        request = _youtube.playlists().list_next(request, response)
+
     return playlists
 
+def get_playlists(youtube):
+    """Get all playlists for the authenticated user"""
+    return _fetch_playlists_raw(youtube, st.session_state.creds_dict['token'])
+
+@st.cache_data(show_spinner=False)
+def _playlists_by_title(playlists):
+    """Index playlists by title; cached so fragment reruns skip the pass"""
+    return {playlist['title']: playlist for playlist in playlists}
+
+@st.cache_resource(show_spinner=False)
+def _db():
+    """Long-lived audit database connection shared across reruns
+
+    Opening a connection per query re-parses the schema and throws away
+    SQLite's page cache each time; one cached connection keeps a 20 MB
+    page cache warm. WAL keeps audit reads from blocking the
+    delete-path writes.
+    """
+    conn = sqlite3.connect(AUDIT_DB, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
+def init_db():
+    """Create the audit table if it does not exist"""
+    conn = _db()
+    conn.execute('''CREATE TABLE IF NOT EXISTS audit_log
+        (video_id TEXT,
+         title TEXT,
+         link TEXT,
+         channel TEXT,
+         playlist_id TEXT,
+         playlist_name TEXT,
+         removed_date TIMESTAMP)''')
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_audit_date ON audit_log(removed_date)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_audit_playlist ON audit_log(playlist_id)")
+    conn.commit()
+
+def store_audit_many(rows):
+    """Record removed videos in the audit database in one transaction"""
+    conn = _db()
+    with conn:
+        conn.executemany("INSERT INTO audit_log VALUES (?,?,?,?,?,?,?)", rows)
+
+def remove_videos(youtube, item_ids):
+    """Remove playlist items via the batch endpoint
+
+    Sub-requests are packed 50 per multipart call instead of one HTTPS
+    round-trip per video. Returns the removed item ids and any errors
+    keyed by item id.
+    """
+    removed = []
+    errors = {}
+
+    def collect(request_id, response, exception):
+        if exception is None:
+            removed.append(request_id)
+        else:
+            errors[request_id] = exception
+
+    for start in range(0, len(item_ids), 50):
+        batch = youtube.new_batch_http_request(callback=collect)
+        for item_id in item_ids[start:start + 50]:
+            batch.add(
+                youtube.playlistItems().delete(id=item_id),
+                request_id=item_id
+            )
+        try:
+            batch.execute()
+        except Exception as e:
+            # A transport-level failure loses the whole batch, not just
+            # one sub-request. Mark this chunk and everything not yet
+            # attempted as failed, but keep the ids already removed so
+            # the caller still audits them.
+            for item_id in item_ids[start:]:
+                if item_id not in removed:
+                    errors.setdefault(item_id, e)
+            break
+
+    return removed, errors
+
+@st.cache_data(ttl=600, show_spinner="Loading videos…")
+def _fetch_playlist_items(_youtube, playlist_id, version_key):
+    """Fetch all videos in a playlist
+
+    Cached per playlist and version key (the playlist's item count), so
+    the entry self-invalidates when the playlist changes while reruns
+    within a session skip the paged refetch.
+    """
+    request = _youtube.playlistItems().list(
+        part="snippet",
+        playlistId=playlist_id,
+        maxResults=50,
+        fields="items(id,snippet/title,snippet/channelTitle,"
+               "snippet/resourceId/videoId),nextPageToken"
+    )
+
+    items = []
+    while request is not None:
+        response = request.execute()
+        items.extend(response.get('items', ()))
+        request = _youtube.playlistItems().list_next(request, response)
+
+    return items
+
+def get_playlist_items(youtube, playlist):
+    """Get all videos in a playlist"""
+    return _fetch_playlist_items(youtube, playlist['id'], playlist['item_count'])
+
+@st.cache_resource(show_spinner=False)
+def _build_youtube(token, refresh_token, token_uri, client_id, client_secret):
+    """Build the YouTube client once per credential set and reuse it across reruns"""
+    credentials = google.oauth2.credentials.Credentials(
+        token=token,
+        refresh_token=refresh_token,
+        token_uri=token_uri,
+        client_id=client_id,
+        client_secret=client_secret,
+        scopes=SCOPES
+    )
+    _, discovery = _google_modules()
+    return discovery.build(
+        API_SERVICE_NAME, API_VERSION, credentials=credentials,
+        cache_discovery=False, static_discovery=True
+    )
+
 def initialize_youtube_client(credentials):
     """Initialize YouTube client with credentials"""
     try:
-        return googleapiclient.discovery.build(
-            API_SERVICE_NAME, API_VERSION, credentials=credentials
+        return _build_youtube(
+            credentials.token,
+            credentials.refresh_token,
+            credentials.token_uri,
+            credentials.client_id,
+            credentials.client_secret
         )
     except Exception as e:
         st.error(f"Error initializing YouTube client: {str(e)}")
         return None
 
+def _refresh_and_save(credentials):
+    """Refresh credentials and persist them; runs on the worker thread"""
+    credentials.refresh(google.auth.transport.requests.Request())
+    save_credentials(credentials)
+    return credentials_to_dict(credentials)
+
+def refresh_credentials_if_stale(credentials):
+    """Refresh credentials before they expire, off the rerun path
+
+    Inside the stale window the refresh runs on a worker thread while
+    the still-valid token keeps serving requests; only a token that is
+    already expired blocks the rerun. Returns the current (possibly
+    refreshed) credentials.
+    """
+    if not credentials.refresh_token:
+        return credentials
+
+    future = st.session_state.get('refresh_future')
+    if future is not None and future.done():
+        st.session_state.refresh_future = None
+        return credentials_from_dict(future.result())
+
+    if credentials.expired:
+        # Hard expiry: wait for an in-flight refresh, or do it inline
+        if future is not None:
+            creds_dict = future.result()
+            st.session_state.refresh_future = None
+            return credentials_from_dict(creds_dict)
+        _refresh_and_save(credentials)
+        return credentials
+
+    if future is None and credentials.expiry is not None:
+        ttl = (credentials.expiry - datetime.utcnow()).total_seconds()
+        if ttl < REFRESH_WINDOW_SECONDS:
+            st.session_state.refresh_future = _REFRESH_EXECUTOR.submit(
+                _refresh_and_save, credentials
+            )
+    return credentials
+
+def audit_log_page():
+    """Audit Log page: removed videos, filterable by removal date
+
+    Filtering and pagination happen in SQL against the indexed
+    removed_date column instead of materializing the whole table into a
+    DataFrame on every rerun.
+    """
+    st.header("Audit Log")
+
+    conn = _db()
+    if st.checkbox("Filter by date"):
+        date_filter = st.date_input("Removed on")
+        audit_df = pd.read_sql_query(
+            "SELECT * FROM audit_log WHERE date(removed_date) = ?"
+            " ORDER BY removed_date DESC",
+            conn, params=[date_filter.isoformat()],
+            parse_dates=['removed_date']
+        )
+    else:
+        page = st.number_input("Page", min_value=1, value=1)
+        audit_df = pd.read_sql_query(
+            "SELECT * FROM audit_log ORDER BY removed_date DESC"
+            " LIMIT 1000 OFFSET ?",
+            conn, params=[(page - 1) * 1000],
+            parse_dates=['removed_date']
+        )
+
+    st.dataframe(audit_df, hide_index=True)
+
+    # Serialize straight to bytes so the download payload is not held
+    # as both str and bytes
+    buffer = io.BytesIO()
+    audit_df.to_csv(buffer, index=False, date_format='%Y-%m-%dT%H:%M:%S')
+    st.download_button(
+        "Download CSV",
+        buffer.getvalue(),
+        file_name="audit_log.csv",
+        mime="text/csv"
+    )
+
+# 403 reasons that mean the credentials themselves are bad. Quota and
+# rate-limit errors also come back as 403 and must not tear the session
+# down, or the next run rehydrates from the cookie and loops
+AUTH_403_REASONS = {'authError', 'forbidden', 'insufficientPermissions'}
+
+def _is_auth_error(error):
+    """Whether an HttpError means the credentials were rejected
+
+    401 always is; 403 only when the error reason is auth-related
+    (quotaExceeded et al. are 403s that a fresh sign-in cannot fix).
+    """
+    status = error.resp.status
+    if status == 401:
+        return True
+    if status != 403:
+        return False
+    try:
+        reasons = {
+            detail.get('reason')
+            for detail in error.error_details
+            if isinstance(detail, dict)
+        }
+    except Exception:
+        # Unparseable error body; treat as transient rather than
+        # throwing away a possibly fine session
+        return False
+    return bool(reasons & AUTH_403_REASONS)
+
+def clear_session_and_rerun(cookie_manager=None):
+    """Drop saved credentials, cookie and session state, then restart
+    the script"""
+    if cookie_manager is not None:
+        delete_refresh_cookie(cookie_manager)
+    if os.path.exists(CREDENTIALS_FILE):
+        os.remove(CREDENTIALS_FILE)
+
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    st.query_params.clear()
+    st.rerun()
+
+def handle_api_error(error, cookie_manager=None):
+    """Classify an API failure and react in one place
+
+    Shared by main and the fragments: fragment reruns re-enter the
+    fragment directly, not main's try/except, so they need the same
+    classification applied locally.
+    """
+    if isinstance(error, googleapiclient.errors.HttpError):
+        if _is_auth_error(error):
+            # Credentials were rejected; force a fresh sign-in
+            clear_session_and_rerun(cookie_manager)
+        else:
+            # Transient API failure; keep the session instead of
+            # dragging the user through the OAuth flow again
+            st.session_state.retry_count = st.session_state.get('retry_count', 0) + 1
+            if st.session_state.retry_count > 3:
+                clear_session_and_rerun(cookie_manager)
+            st.error(f"Error accessing YouTube API: {str(error)}")
+    elif isinstance(error, google.auth.exceptions.RefreshError):
+        clear_session_and_rerun(cookie_manager)
+    else:
+        st.error(f"Error accessing YouTube API: {str(error)}")
+
+@st.fragment
+def cleanup_table(youtube, df, playlist, cookie_manager):
+    """Filter and selection table for one playlist
+
+    Nested fragment: typing in the search box or changing the channel
+    filter reruns only this block with the already-fetched DataFrame,
+    not the playlist fetch above it.
+    """
+    search_term = st.text_input("Search titles", key=f"search_{playlist['id']}")
+    channel_filter = st.multiselect(
+        "Filter by channel",
+        df['channel'].cat.categories.tolist(),
+        key=f"channels_{playlist['id']}"
+    )
+
+    filtered_df = df
+    if search_term:
+        pattern = re.compile(re.escape(search_term), re.IGNORECASE)
+        filtered_df = filtered_df[
+            filtered_df['title'].str.contains(pattern, regex=True, na=False)
+        ]
+    if channel_filter:
+        filtered_df = filtered_df[filtered_df['channel'].isin(channel_filter)]
+
+    edited = st.data_editor(
+        filtered_df,
+        hide_index=True,
+        disabled=[column for column in df.columns if column != 'remove'],
+        column_config={'item_id': None},
+        key=f"items_{playlist['id']}_{hash((search_term, tuple(channel_filter)))}"
+    )
+
+    selected = edited[edited['remove']]
+    if st.button("Remove Selected Videos", disabled=selected.empty):
+        removed, errors = remove_videos(youtube, list(selected['item_id']))
+
+        removed_date = datetime.now()
+        removed_set = set(removed)
+        store_audit_many([
+            (
+                row.video_id,
+                row.title,
+                row.link,
+                row.channel,
+                playlist['id'],
+                playlist['title'],
+                removed_date
+            )
+            for row in selected.itertuples()
+            if row.item_id in removed_set
+        ])
+
+        message = f"Removed {len(removed)} videos."
+        if errors:
+            message += f" Failed to remove {len(errors)}."
+        st.session_state.cleanup_message = message
+
+        # Rejected credentials surface here as per-item errors, not in
+        # main's except block; reclassify so a revoked token forces a
+        # fresh sign-in instead of looping on "Failed to remove"
+        for error in errors.values():
+            if (isinstance(error, googleapiclient.errors.HttpError)
+                    and _is_auth_error(error)):
+                handle_api_error(error, cookie_manager)
+                break
+
+        # The playlist contents changed; drop the cached item pages and
+        # playlist counts, then rerun the whole script to refetch
+        _fetch_playlist_items.clear()
+        _fetch_playlists_raw.clear()
+        st.rerun()
+
+@st.fragment
+def playlist_view(youtube, playlists, cookie_manager):
+    """Playlist selector and video listing, scoped to a fragment so
+    changing the selection reruns only this block instead of the whole
+    script"""
+    if 'cleanup_message' in st.session_state:
+        st.success(st.session_state.pop('cleanup_message'))
+
+    playlists_by_title = _playlists_by_title(playlists)
+    selected_playlist = st.selectbox(
+        "Select a playlist:",
+        list(playlists_by_title)
+    )
+
+    if selected_playlist:
+        playlist = playlists_by_title[selected_playlist]
+        st.write(f"Selected playlist ID: {playlist['id']}")
+        st.caption(f"{playlist['item_count']} videos")
+
+        try:
+            items = get_playlist_items(youtube, playlist)
+        except Exception as e:
+            handle_api_error(e, cookie_manager)
+            return
+        if items:
+            # Columnar construction: one list per column skips the
+            # dict-of-dicts path and pandas' per-row type inference
+            snippets = [item['snippet'] for item in items]
+            video_ids = [snippet['resourceId']['videoId'] for snippet in snippets]
+            df = pd.DataFrame({
+                'item_id': [item['id'] for item in items],
+                'video_id': video_ids,
+                'title': [snippet['title'] for snippet in snippets],
+                'channel': [snippet['channelTitle'] for snippet in snippets],
+                'link': ['https://youtube.com/watch?v=' + video_id
+                         for video_id in video_ids]
+            })
+            df['channel'] = df['channel'].astype('category')
+            # Arrow-backed strings so the search filter runs through
+            # Arrow's matcher instead of the object-dtype Python loop
+            df['title'] = df['title'].astype('string[pyarrow]')
+            df.insert(0, 'remove', False)
+
+            cleanup_table(youtube, df, playlist, cookie_manager)
+
 def main():
     st.title("YouTube Playlists Viewer")
-    
+
+    init_db()
+
+    if st.sidebar.radio("Page", ["Playlists", "Audit Log"]) == "Audit Log":
+        audit_log_page()
+        return
+
     # Initialize session state
     if 'authenticated' not in st.session_state:
         st.session_state.authenticated = False
-    if 'credentials' not in st.session_state:
-        st.session_state.credentials = None
-    if 'youtube' not in st.session_state:
-        st.session_state.youtube = None
-    
-    # Try to load credentials if not authenticated
+    if 'creds_dict' not in st.session_state:
+        st.session_state.creds_dict = None
+
+    cookie_manager = stx.CookieManager()
+
     if not st.session_state.authenticated:
-        credentials = load_credentials()
+        # Read the credentials file once per session; the sentinel keeps
+        # later unauthenticated reruns from re-hitting the disk
+        credentials = None
+        if not st.session_state.get('creds_checked'):
+            st.session_state.creds_checked = True
+            credentials = load_credentials()
+
+        # Fall back to the refresh token cookie so a browser refresh
+        # does not force a full OAuth round-trip. The cookie component
+        # reports no cookies until it has mounted (typically not on the
+        # first run), so only mark the cookie as checked once it has
+        # actually returned something
+        if credentials is None and not st.session_state.get('cookie_checked'):
+            cookies = cookie_manager.get_all()
+            if cookies:
+                st.session_state.cookie_checked = True
+                refresh_token = cookies.get(REFRESH_TOKEN_COOKIE)
+                if refresh_token:
+                    try:
+                        credentials = credentials_from_refresh_token(refresh_token)
+                        credentials.refresh(google.auth.transport.requests.Request())
+                        save_credentials(credentials)
+                    except Exception:
+                        delete_refresh_cookie(cookie_manager)
+                        credentials = None
+
         if credentials and credentials.valid:
-            youtube = initialize_youtube_client(credentials)
-            if youtube:
-                st.session_state.update({
-                    'authenticated': True,
-                    'credentials': credentials,
-                    'youtube': youtube
-                })
+            st.session_state.update({
+                'authenticated': True,
+                'creds_dict': credentials_to_dict(credentials)
+            })
         elif credentials and credentials.expired and credentials.refresh_token:
             try:
                 credentials.refresh(google.auth.transport.requests.Request())
-                youtube = initialize_youtube_client(credentials)
-                if youtube:
-                    st.session_state.update({
-                        'authenticated': True,
-                        'credentials': credentials,
-                        'youtube': youtube
-                    })
-                    save_credentials(credentials)
+                st.session_state.update({
+                    'authenticated': True,
+                    'creds_dict': credentials_to_dict(credentials)
+                })
+                save_credentials(credentials)
             except Exception as e:
                 st.error(f"Error refreshing credentials: {str(e)}")
     
-    query_params = st.experimental_get_query_params()
+    query_params = st.query_params
     
-    # Debug information
-    with st.expander("Debug Information"):
-        st.write("Current URL parameters:", query_params)
-        st.write("Session State Contents:")
-        for key, value in st.session_state.items():
-            if key in ['youtube', 'credentials']:
-                st.write(f"{key}: <object>")
-            else:
-                st.write(f"{key}: {value}")
+    # Debug information; lazily formatted as one code block so the
+    # off-by-default path costs nothing per rerun
+    if st.sidebar.toggle("Debug", value=False, key="_debug"):
+        with st.expander("Debug Information"):
+            lines = [f"query_params: {query_params.to_dict()}"]
+            lines.extend(
+                f"{key}: <redacted>"
+                if key in ('creds_dict', 'refresh_future')
+                else f"{key}: {value}"
+                for key, value in st.session_state.items()
+            )
+            st.code("\n".join(lines))
     
     # Handle OAuth callback
     if not st.session_state.authenticated and 'code' in query_params:
         try:
-            code = query_params['code'][0]
-            received_state = query_params.get('state', [None])[0]
+            code = query_params['code']
+            received_state = query_params.get('state')
             
-            if 'state' in st.session_state and received_state != st.session_state.state:
+            if 'state' in st.session_state and not hmac.compare_digest(
+                received_state or '', st.session_state.state
+            ):
                 st.error("State mismatch. Possible security issue.")
                 raise ValueError("State mismatch")
             
-            flow = google_auth_oauthlib.flow.Flow.from_client_config(
-                {
-                    "web": {
-                        "client_id": st.secrets["client_id"],
-                        "client_secret": st.secrets["client_secret"],
-                        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                        "token_uri": "https://oauth2.googleapis.com/token",
-                        "redirect_uris": [st.secrets["redirect_uri"]]
-                    }
-                },
-                scopes=SCOPES
-            )
-            flow.redirect_uri = st.secrets["redirect_uri"]
-            
-            flow.fetch_token(
-                code=code,
-                client_secret=st.secrets["client_secret"],
-            )
-            
-            credentials = flow.credentials
-            youtube = initialize_youtube_client(credentials)
-            
-            if youtube:
-                st.session_state.update({
-                    'authenticated': True,
-                    'credentials': credentials,
-                    'youtube': youtube
-                })
-                save_credentials(credentials)
-            
-            st.experimental_set_query_params()
+            credentials = exchange_code(code)
+
+            st.session_state.update({
+                'authenticated': True,
+                'creds_dict': credentials_to_dict(credentials)
+            })
+            save_credentials(credentials)
+            if credentials.refresh_token:
+                cookie_manager.set(
+                    REFRESH_TOKEN_COOKIE,
+                    credentials.refresh_token,
+                    expires_at=datetime.now() + timedelta(days=30),
+                    secure=True,
+                    same_site='lax'
+                )
+
+            query_params.clear()
             
         except Exception as e:
             st.error(f"Authentication error: {str(e)}")
             if st.button("Try Again"):
                 for key in list(st.session_state.keys()):
                     del st.session_state[key]
-                st.experimental_set_query_params()
+                query_params.clear()
                 st.rerun()
     
     # Show authorization URL if not authenticated
@@ -210,48 +736,42 @@ def main():
             st.error(f"Error generating authorization URL: {str(e)}")
     
     # Show playlists if authenticated
-    if st.session_state.authenticated and st.session_state.youtube:
+    if st.session_state.authenticated and st.session_state.creds_dict:
         try:
-            playlists = get_playlists(st.session_state.youtube)
+            # Rebuild credentials from the minimal session dict and
+            # refresh them, in the background when possible
+            credentials = refresh_credentials_if_stale(
+                credentials_from_dict(st.session_state.creds_dict)
+            )
+            st.session_state.creds_dict = credentials_to_dict(credentials)
+
+            # The client factory is cached, so this is a dict lookup
+            # rather than a rebuild
+            youtube = initialize_youtube_client(credentials)
+            playlists = get_playlists(youtube)
+            st.session_state.pop('retry_count', None)
             
             if playlists:
-                playlist_titles = [playlist['title'] for playlist in playlists]
-                selected_playlist = st.selectbox(
-                    "Select a playlist:",
-                    playlist_titles
-                )
-                
-                if selected_playlist:
-                    selected_playlist_id = next(
-                        playlist['id'] for playlist in playlists 
-                        if playlist['title'] == selected_playlist
-                    )
-                    st.write(f"Selected playlist ID: {selected_playlist_id}")
+                playlist_view(youtube, playlists, cookie_manager)
             else:
                 st.write("No playlists found.")
             
             if st.button("Logout"):
-                # Remove credentials file
+                # Remove credentials file, cookie and cached API responses
+                _fetch_playlists_raw.clear()
+                _fetch_playlist_items.clear()
+                delete_refresh_cookie(cookie_manager)
                 if os.path.exists(CREDENTIALS_FILE):
                     os.remove(CREDENTIALS_FILE)
                 
                 # Clear session state
                 for key in list(st.session_state.keys()):
                     del st.session_state[key]
-                st.experimental_set_query_params()
+                query_params.clear()
                 st.rerun()
             
         except Exception as e:
-            st.error(f"Error accessing YouTube API: {str(e)}")
-            # Remove credentials file
-            if os.path.exists(CREDENTIALS_FILE):
-                os.remove(CREDENTIALS_FILE)
-            
-            # Clear session state
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
-            st.experimental_set_query_params()
-            st.rerun()
+            handle_api_error(e, cookie_manager)
 
 if __name__ == "__main__":
     main()